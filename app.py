@@ -1,18 +1,58 @@
 # app.py
 import streamlit as st
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyogrio
 import zipfile
+import contextlib
 import tempfile
-import shutil
 import os
 import io
-import uuid
 import time
-import glob
-from shapely.geometry import Polygon, MultiPolygon, GeometryCollection, LineString, MultiLineString
-from shapely.ops import unary_union, polygonize, linemerge
-import folium
-from streamlit_folium import st_folium
+from concurrent.futures import ThreadPoolExecutor
+import shapely
+
+# pyogrio reads/writes through vectorized GDAL calls instead of Fiona's per-feature loop
+gpd.options.io_engine = "pyogrio"
+
+# Arrow hand-off on read needs GDAL >= 3.6 and pyarrow; decided once here so a
+# failing read is reported as-is instead of being retried without Arrow
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+USE_ARROW_READ = HAS_PYARROW and pyogrio.__gdal_version__ >= (3, 6, 0)
+# Arrow write passes whole columns to GDAL instead of one feature at a time; GDAL >= 3.8
+USE_ARROW_WRITE = HAS_PYARROW and pyogrio.__gdal_version__ >= (3, 8, 0)
+
+# geometry types kept by the SQLite read (ST_GeometryType prefixes, so " Z" variants match)
+POLYGON_SQL_TYPES = ("POLYGON", "MULTIPOLYGON", "GEOMETRYCOLLECTION")
+LINE_SQL_TYPES = ("LINESTRING", "MULTILINESTRING", "GEOMETRYCOLLECTION")
+
+# SQLite allows at most 500 terms in one compound SELECT; the schema query uses
+# two per layer, so read at most this many layers per query
+SQL_LAYERS_PER_QUERY = 200
+
+# layer columns LIBKML exposes to SQL that are not attributes
+KML_SQL_SKIP_COLUMNS = {"GEOMETRY", "OGR_NATIVE_DATA", "OGR_NATIVE_MEDIA_TYPE"}
+
+# declared column types (pragma_table_info) to restore after a UNION ALL read
+SQL_NUMERIC_TYPES = ("INTEGER", "BIGINT", "FLOAT")
+SQL_DATETIME_TYPES = ("TIMESTAMP", "DATE")
+
+# GEOS geometry type ids (shapely.GeometryType)
+POLYGON_TYPE_IDS = (3, 6)  # Polygon, MultiPolygon
+LINE_TYPE_IDS = (1, 5)  # LineString, MultiLineString
+GEOMETRYCOLLECTION_TYPE_ID = 7
+
+# preview-only simplification: tolerance is the data extent divided by this,
+# roughly one screen pixel once the map is fitted to the bounds
+PREVIEW_SIMPLIFY_STEPS = 2000
+
+# files GDAL writes for one shapefile layer
+SHAPEFILE_EXTS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
 
 # ---------- Helpers ----------
 def is_kmz(name: str):
@@ -21,141 +61,263 @@ def is_kmz(name: str):
 def is_kml(name: str):
     return name.lower().endswith(".kml")
 
-def extract_kmz(kmz_path: str, dest_dir: str):
-    with zipfile.ZipFile(kmz_path, "r") as z:
-        z.extractall(dest_dir)
-    for root, _, files in os.walk(dest_dir):
-        for f in files:
-            if f.lower().endswith(".kml"):
-                return os.path.join(root, f)
+def read_kmz_kml(kmz_file):
+    # kmz_file is a path or a seekable file object (e.g. the Streamlit upload).
+    # find the KML in the central directory and read just that member into memory,
+    # instead of extracting the whole archive (overlays, icons) to disk
+    with zipfile.ZipFile(kmz_file, "r") as z:
+        for info in z.infolist():
+            name = info.filename.lower()
+            # skip macOS sidecars (__MACOSX/._doc.kml) that also end in .kml
+            if name.startswith("__macosx/") or os.path.basename(name).startswith("._"):
+                continue
+            if name.endswith(".kml") and not info.is_dir():
+                return z.read(info)
     return None
 
-def read_kml(kml_path: str):
-    # try normal read, else explicit KML driver
-    try:
-        gdf = gpd.read_file(kml_path)
-        if gdf is None or len(gdf) == 0:
-            gdf = gpd.read_file(kml_path, driver="KML")
-        return gdf
-    except Exception:
-        return gpd.read_file(kml_path, driver="KML")
-
-def extract_polygons_from_geom(geom):
-    out = []
-    if geom is None:
-        return out
-    t = geom.geom_type
-    if t == "Polygon":
-        out.append(geom)
-    elif t == "MultiPolygon":
-        out.append(geom)
-    elif t == "GeometryCollection":
-        for part in geom.geoms:
-            if part.geom_type in ("Polygon", "MultiPolygon"):
-                out.append(part)
-    return out
+def read_file_pyogrio(src, **kwargs):
+    return gpd.read_file(src, engine="pyogrio", use_arrow=USE_ARROW_READ, **kwargs)
+
+def write_file_pyogrio(gdf, path, **kwargs):
+    gdf.to_file(path, engine="pyogrio", use_arrow=USE_ARROW_WRITE, **kwargs)
+
+def list_kml_layers(kml_src):
+    # LIBKML reports every folder as geometry type "Unknown", so the layer
+    # definitions cannot tell polygon folders from point ones; list them all
+    return [name for name, _ in pyogrio.list_layers(kml_src)]
+
+def sql_ident(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+def sql_literal(value: str):
+    return "'" + value.replace("'", "''") + "'"
+
+def read_kml_fields(kml_src, layers):
+    # attribute columns of each layer with their declared types, from one query over
+    # pragma_table_info; SQLite only sees a layer once it is named in a FROM, hence
+    # the empty SELECTs
+    selects = [
+        f"SELECT {sql_literal(layer)} AS layer, name, type"
+        f" FROM pragma_table_info({sql_literal(layer)})"
+        for layer in layers
+    ]
+    selects += [f"SELECT NULL, NULL, NULL FROM {sql_ident(layer)} WHERE 0" for layer in layers]
+    df = read_file_pyogrio(
+        kml_src, sql=" UNION ALL ".join(selects), sql_dialect="SQLITE", read_geometry=False
+    )
+    fields = {layer: {} for layer in layers}
+    for layer, name, sql_type in zip(df["layer"], df["name"], df["type"]):
+        if name not in KML_SQL_SKIP_COLUMNS:
+            fields[layer][name] = sql_type
+    return fields
+
+def restore_field_types(gdf, field_types):
+    # GDAL types each column of a compound SELECT from its first value, so a column
+    # whose first row is a NULL pad comes back as text; convert it to the declared type
+    for name, sql_type in field_types.items():
+        col = gdf[name]
+        if sql_type.startswith(SQL_NUMERIC_TYPES) and not pd.api.types.is_numeric_dtype(col):
+            gdf[name] = pd.to_numeric(col, errors="coerce")
+        elif sql_type.startswith(SQL_DATETIME_TYPES) and not pd.api.types.is_datetime64_any_dtype(col):
+            gdf[name] = pd.to_datetime(col, utc=True, format="ISO8601", errors="coerce")
+    return gdf
+
+def read_kml_layers(kml_src, layers, geometry_types):
+    # KML folders come in as separate layers, and every LIBKML open parses the whole
+    # document again; read the layers in one UNION ALL query per batch instead of one
+    # read per layer, keeping only features whose geometry type is in geometry_types
+    geometry_pred = " OR ".join(
+        f"ST_GeometryType(GEOMETRY) LIKE '{t}%'" for t in geometry_types
+    )
+    frames = []
+    for start in range(0, len(layers), SQL_LAYERS_PER_QUERY):
+        batch = layers[start:start + SQL_LAYERS_PER_QUERY]
+        fields = read_kml_fields(kml_src, batch)
+        # UNION ALL needs the same columns in every SELECT; pad missing ones with NULL
+        field_types = {}
+        for layer in batch:
+            for name, sql_type in fields[layer].items():
+                field_types.setdefault(name, sql_type)
+        selects = []
+        for layer in batch:
+            present = fields[layer]
+            cols = [
+                sql_ident(c) if c in present else f"NULL AS {sql_ident(c)}" for c in field_types
+            ]
+            selects.append(
+                f"SELECT {', '.join(cols + ['GEOMETRY'])} FROM {sql_ident(layer)}"
+                f" WHERE {geometry_pred}"
+            )
+        gdf = read_file_pyogrio(kml_src, sql=" UNION ALL ".join(selects), sql_dialect="SQLITE")
+        if len(gdf) > 0:
+            frames.append(restore_field_types(gdf, field_types))
+    if not frames:
+        return gpd.GeoDataFrame(columns=["geometry"], geometry="geometry")
+    # concatenating GeoDataFrames already yields a GeoDataFrame with their CRS
+    return pd.concat(frames, ignore_index=True)
+
+def read_kml_polygons(kml_src):
+    return read_kml_layers(kml_src, list_kml_layers(kml_src), POLYGON_SQL_TYPES)
+
+def read_kml_lines(kml_src):
+    return read_kml_layers(kml_src, list_kml_layers(kml_src), LINE_SQL_TYPES)
 
 def filter_polygons_gdf(gdf: gpd.GeoDataFrame):
-    rows = []
-    for idx, row in gdf.iterrows():
-        geom = row.geometry
-        if geom is None:
-            continue
-        parts = extract_polygons_from_geom(geom)
-        if not parts:
-            continue
-        for p in parts:
-            new = row.copy()
-            new.geometry = p
-            rows.append(new)
-    if not rows:
-        return gpd.GeoDataFrame(columns=list(gdf.columns), geometry="geometry", crs=gdf.crs)
-    gdf_poly = gpd.GeoDataFrame(rows, columns=list(gdf.columns), geometry="geometry", crs=gdf.crs)
-    return gdf_poly.reset_index(drop=True)
+    # work on the raw geometry array plus the row each geometry came from,
+    # then gather the attribute rows once at the end
+    geoms = np.asarray(gdf.geometry.values)
+    parent_idx = np.arange(len(geoms))
+    # integer type ids come straight from GEOS, no per-row geom_type strings
+    type_ids = shapely.get_type_id(geoms)
+    # split GeometryCollections into their parts; MultiPolygons stay whole
+    is_gc = type_ids == GEOMETRYCOLLECTION_TYPE_ID
+    if is_gc.any():
+        gc_idx = np.flatnonzero(is_gc)
+        parts, part_of = shapely.get_parts(geoms[gc_idx], return_index=True)
+        parent_idx = np.concatenate([parent_idx[~is_gc], gc_idx[part_of]])
+        geoms = np.concatenate([geoms[~is_gc], parts])
+        # stable sort puts the parts back where their collection was
+        order = np.argsort(parent_idx, kind="stable")
+        parent_idx, geoms = parent_idx[order], geoms[order]
+        type_ids = shapely.get_type_id(geoms)
+    # null geometries have type id -1, so this single mask drops them as well
+    keep = np.isin(type_ids, POLYGON_TYPE_IDS)
+    # build the result in one constructor: gather every attribute column's array with
+    # the kept row positions and put the (possibly exploded) geometries in directly
+    idx = parent_idx[keep]
+    geom_name = gdf.geometry.name
+    data = {
+        c: geoms[keep] if c == geom_name else gdf[c].array.take(idx)
+        for c in gdf.columns
+    }
+    return gpd.GeoDataFrame(
+        data, geometry=geom_name, crs=gdf.crs, index=pd.RangeIndex(len(idx))
+    )
 
 def lines_to_polygons(gdf):
     """
     Try to create polygons from LineString / MultiLineString geometries.
     Approach:
       - collect all linear geometries
-      - merge/union them into a network
-      - run shapely.ops.polygonize on the network to get polygons
+      - union them into a noded network
+      - run shapely.polygonize on the network to get polygons
     Returns a GeoDataFrame with geometry column only (no attributes).
     """
-    lines = []
-    for geom in gdf.geometry:
-        if geom is None:
-            continue
-        if geom.geom_type in ("LineString", "MultiLineString"):
-            lines.append(geom)
-        # Sometimes polygons are represented as closed LineString — include them too
-        if geom.geom_type == "Polygon":
-            # skip polygons (we handle polygons elsewhere)
-            pass
-        # GeometryCollection may contain lines
-        if geom.geom_type == "GeometryCollection":
-            for part in geom.geoms:
-                if part.geom_type in ("LineString", "MultiLineString"):
-                    lines.append(part)
-    if not lines:
+    geoms = np.asarray(gdf.geometry.values)
+    type_ids = shapely.get_type_id(geoms)
+    # closed rings already stored as Polygon are handled by filter_polygons_gdf
+    lines = geoms[np.isin(type_ids, LINE_TYPE_IDS)]
+    # GeometryCollection may contain lines; flatten them all in one GEOS call
+    is_gc = type_ids == GEOMETRYCOLLECTION_TYPE_ID
+    if is_gc.any():
+        parts = shapely.get_parts(geoms[is_gc])
+        lines = np.concatenate([lines, parts[np.isin(shapely.get_type_id(parts), LINE_TYPE_IDS)]])
+    if len(lines) == 0:
         return gpd.GeoDataFrame(columns=["geometry"], geometry="geometry")
 
-    # Merge lines into a single geometry/network
-    try:
-        merged = linemerge(lines)
-    except Exception:
-        merged = unary_union(lines)
+    # Node the lines into a single network: unary_union (GEOS cascaded union) splits
+    # lines where they cross, which linemerge does not, so polygonize sees closed rings
+    # hand the lines over sorted by min-x/min-y so the union's tree build sees
+    # spatially coherent input
+    bounds = shapely.bounds(lines)
+    lines = lines[np.lexsort((bounds[:, 1], bounds[:, 0]))]
+    merged = shapely.unary_union(lines)
 
-    # polygonize expects an iterable of linear geometries (MultiLineString / LineString)
-    polys = list(polygonize(merged))
-    if not polys:
-        # try polygonize unary_union of lines
-        try:
-            polys = list(polygonize(unary_union(lines)))
-        except Exception:
-            polys = []
+    # one GEOS call returns a GeometryCollection of all rings; get_parts unpacks it
+    # into an array without iterating the collection in Python
+    polys = shapely.get_parts(shapely.polygonize([merged]))
 
-    if not polys:
+    if len(polys) == 0:
         return gpd.GeoDataFrame(columns=["geometry"], geometry="geometry")
 
     gdf_polys = gpd.GeoDataFrame(geometry=polys, crs=gdf.crs)
     return gdf_polys.reset_index(drop=True)
 
-def write_shapefile_and_zip(gdf, out_dir, base_name):
-    os.makedirs(out_dir, exist_ok=True)
-    shp_path = os.path.join(out_dir, f"{base_name}.shp")
-    # If there are no properties (only geometry), ensure it's saved with a simple schema.
-    gdf.to_file(shp_path, driver="ESRI Shapefile")
-    base = os.path.splitext(shp_path)[0]
-    files = glob.glob(f"{base}.*")
-    zip_path = os.path.join(out_dir, f"{base_name}.zip")
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for f in files:
-            z.write(f, arcname=os.path.basename(f))
-    return zip_path
-
-def make_folium_map(gdf_poly):
-    # ensure GeoDataFrame is in EPSG:4326 for folium
-    try:
-        if gdf_poly.crs is None:
-            gdf_4326 = gdf_poly.to_crs(epsg=4326)
-        else:
+@contextlib.contextmanager
+def kml_file(kml_bytes: bytes):
+    # pyogrio copies a bytes buffer into a fresh /vsimem file on every call, and LIBKML
+    # names the layer of an unnamed document after that file, so a layer name listed
+    # by one call would not exist in the next; give GDAL one stable path instead
+    with tempfile.TemporaryDirectory(prefix="kml2shp_") as tmp:
+        kml_path = os.path.join(tmp, "doc.kml")
+        with open(kml_path, "wb") as fh:
+            fh.write(kml_bytes)
+        yield kml_path
+
+def load_polygons(kml_bytes: bytes):
+    with kml_file(kml_bytes) as kml_path:
+        return filter_polygons_gdf(read_kml_polygons(kml_path))
+
+def load_line_polygons(kml_bytes: bytes):
+    # returns (number of features read, polygons built from lines)
+    with kml_file(kml_bytes) as kml_path:
+        gdf = read_kml_lines(kml_path)
+    if gdf is None or len(gdf) == 0:
+        return 0, None
+    return len(gdf), lines_to_polygons(gdf)
+
+def write_shapefile_and_zip(gdf, base_name, compression=zipfile.ZIP_STORED):
+    # GDAL can only write the multi-file shapefile to real files, so the parts live in a
+    # throwaway directory for the duration of this call; the ZIP itself is built in memory
+    # and goes straight to the download button.
+    # Stored by default to skip the CPU-bound deflate pass (the HTTP layer can still gzip
+    # the download); pass ZIP_DEFLATED when the archive size matters more.
+    with tempfile.TemporaryDirectory(prefix="kml2shp_") as out_dir:
+        shp_path = os.path.join(out_dir, f"{base_name}.shp")
+        # If there are no properties (only geometry), ensure it's saved with a simple schema.
+        write_file_pyogrio(gdf, shp_path, driver="ESRI Shapefile")
+        base = os.path.splitext(shp_path)[0]
+        files = [base + ext for ext in SHAPEFILE_EXTS if os.path.exists(base + ext)]
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", compression=compression) as z:
+            for f in files:
+                z.write(f, arcname=os.path.basename(f))
+    return buf.getvalue()
+
+def make_preview(gdf_poly):
+    # returns (GeoJSON string, bounds) for the map preview
+    # ensure GeoDataFrame is in EPSG:4326 for folium; KML already is, so the common
+    # case skips the transform. Nothing below mutates the frame, so no defensive copy.
+    if gdf_poly.crs is not None and gdf_poly.crs.to_epsg() == 4326:
+        gdf_4326 = gdf_poly
+    else:
+        try:
             gdf_4326 = gdf_poly.to_crs(epsg=4326)
-    except Exception:
-        gdf_4326 = gdf_poly.copy()
+        except Exception:
+            gdf_4326 = gdf_poly
+    geoms = np.asarray(gdf_4326.geometry.values)
 
-    # compute bounds and center
+    # compute bounds
     try:
-        minx, miny, maxx, maxy = gdf_4326.total_bounds
-        center_lat = (miny + maxy) / 2.0
-        center_lon = (minx + maxx) / 2.0
+        minx, miny, maxx, maxy = shapely.total_bounds(geoms)
     except Exception:
-        # fallback to 0,0
-        center_lat, center_lon = 0, 0
-        miny, minx, maxy, maxx = -1, -1, 1, 1
+        # fallback around 0,0
+        minx, miny, maxx, maxy = -1, -1, 1, 1
+
+    # simplify only the preview to shrink the GeoJSON sent to the browser; sub-pixel
+    # detail is invisible once the map is fitted to the bounds. Attributes aren't shown
+    # on the map, so the preview carries geometry only. The shapefile ZIP is written
+    # from the untouched gdf_poly.
+    tolerance = max(maxx - minx, maxy - miny) / PREVIEW_SIMPLIFY_STEPS
+    simplified = shapely.simplify(geoms, tolerance=tolerance, preserve_topology=False)
+    # serialize in GEOS (to_geojson) rather than via __geo_interface__, which builds a
+    # Python tuple per coordinate; only the FeatureCollection wrapper is assembled here
+    features = ",".join(
+        f'{{"type":"Feature","properties":{{}},"geometry":{g}}}' for g in shapely.to_geojson(simplified)
+    )
+    preview_geojson = f'{{"type":"FeatureCollection","features":[{features}]}}'
+    return preview_geojson, (minx, miny, maxx, maxy)
+
+def make_folium_map(preview_geojson, bounds):
+    # imported here so a cold start only pays for folium once there is a map to draw
+    import folium
+
+    minx, miny, maxx, maxy = bounds
+    center_lat = (miny + maxy) / 2.0
+    center_lon = (minx + maxx) / 2.0
 
     m = folium.Map(location=[center_lat, center_lon], zoom_start=10)
-    folium.GeoJson(data=gdf_4326.__geo_interface__, name="polygons").add_to(m)
+    folium.GeoJson(data=preview_geojson, name="polygons").add_to(m)
 
     # fit map to bounds (latlon order)
     try:
@@ -165,6 +327,34 @@ def make_folium_map(gdf_poly):
 
     return m
 
+# Streamlit reruns the whole script on every interaction (including map pan/zoom).
+# The whole pipeline is cached as one entry on the KML bytes and hands back only
+# counts, the ZIP and the preview, so a rerun never unpickles a GeoDataFrame.
+# The cache is shared by all sessions, so keep only the most recent uploads.
+CACHE_MAX_ENTRIES = 8
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def convert_kml(kml_bytes: bytes):
+    # returns ((polygons read, line features read, polygons from lines), output), where
+    # output is (base name, ZIP bytes, preview GeoJSON, preview bounds), or None when
+    # there is nothing to save. The line read only runs when there are no polygons.
+    gdf_poly = load_polygons(kml_bytes)
+    n_polygons, n_lines = len(gdf_poly), 0
+    if n_polygons == 0:
+        n_lines, gdf_poly = load_line_polygons(kml_bytes)
+    counts = (n_polygons, n_lines, 0 if gdf_poly is None else len(gdf_poly))
+    if gdf_poly is None or len(gdf_poly) == 0:
+        return counts, None
+    # the base name is fixed at the first conversion so it matches the ZIP
+    base = f"polygons_{int(time.time())}"
+    # write the shapefile on a worker thread while the preview is built here; the
+    # pyogrio write spends its time inside GDAL, and neither side mutates gdf_poly
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        zip_future = ex.submit(write_shapefile_and_zip, gdf_poly, base)
+        preview_geojson, bounds = make_preview(gdf_poly)
+        zip_bytes = zip_future.result()
+    return counts, (base, zip_bytes, preview_geojson, bounds)
+
 # ---------- Streamlit UI ----------
 st.set_page_config(page_title="KML/KMZ → Polygon Shapefile (ZIP)", layout="centered")
 st.title("Upload KML/KMZ — auto convert polygons (auto polygonize lines) → Shapefile ZIP")
@@ -172,86 +362,60 @@ st.title("Upload KML/KMZ — auto convert polygons (auto polygonize lines) → S
 uploaded = st.file_uploader("Upload .kml or .kmz", type=["kml", "kmz"])
 
 if uploaded is not None:
-    tmp_root = tempfile.mkdtemp(prefix="kml2shp_")
-    uid = uuid.uuid4().hex[:8]
-    work_dir = os.path.join(tmp_root, uid)
-    os.makedirs(work_dir, exist_ok=True)
-
     try:
-        saved = os.path.join(work_dir, uploaded.name)
-        with open(saved, "wb") as f:
-            f.write(uploaded.getbuffer())
-        st.info(f"Saved upload: {uploaded.name}")
+        # the upload is already buffered in memory by Streamlit; read from it
+        # directly instead of writing a second copy to disk
+        st.info(f"Received upload: {uploaded.name}")
 
         # locate KML
-        if is_kmz(saved):
-            exdir = os.path.join(work_dir, "extracted")
-            os.makedirs(exdir, exist_ok=True)
-            kml_path = extract_kmz(saved, exdir)
-            if not kml_path:
+        if is_kmz(uploaded.name):
+            kml_bytes = read_kmz_kml(uploaded)
+            if not kml_bytes:
                 st.error("KMZ has no .kml inside.")
                 raise RuntimeError("No KML in KMZ")
         else:
-            kml_path = saved
-
-        # read KML
-        st.info("Reading KML...")
-        try:
-            gdf = read_kml(kml_path)
-        except Exception as e:
-            st.error(f"Failed to read KML: {e}")
-            raise
-
-        if gdf is None or len(gdf) == 0:
-            st.warning("No features found in KML.")
-            st.stop()
-
-        st.write(f"Total features read: {len(gdf)}")
-
-        # first: try to extract polygonal geometries
-        st.info("Filtering polygon / multipolygon geometries...")
-        gdf_poly = filter_polygons_gdf(gdf)
+            kml_bytes = uploaded.getvalue()
+
+        # read polygons (filtered inside GDAL), fall back to polygonizing lines, then
+        # write the shapefile ZIP and build the preview data
+        with st.spinner("Reading KML, writing shapefile and building preview..."):
+            try:
+                (n_polygons, n_lines, n_line_polygons), output = convert_kml(kml_bytes)
+            except Exception as e:
+                st.error(f"Failed to read KML: {e}")
+                raise
+
+        st.write(f"Polygon features read: {n_polygons}")
+
+        # if none: the line layers were read and polygonized
+        if n_polygons == 0:
+            if n_lines == 0:
+                st.warning("No polygon or line features found in KML.")
+                st.stop()
 
-        # if none: try to polygonize lines
-        if gdf_poly is None or len(gdf_poly) == 0:
-            st.info("No polygons found — attempting to convert lines/polylines to polygons...")
-            gdf_lines_polys = lines_to_polygons(gdf)
-            if gdf_lines_polys is None or len(gdf_lines_polys) == 0:
+            st.info("No polygons found — converted lines/polylines to polygons.")
+            if n_line_polygons == 0:
                 st.warning("Could not produce polygons from lines/polylines. Points/lines are ignored.")
                 # offer original download
-                with open(saved, "rb") as fh:
-                    st.download_button("Download original upload", fh, file_name=uploaded.name)
+                st.download_button("Download original upload", uploaded.getvalue(), file_name=uploaded.name)
                 st.stop()
-            else:
-                # create GeoDataFrame ready for saving (no attributes)
-                gdf_poly = gdf_lines_polys
-                st.success(f"Polygonize produced {len(gdf_poly)} polygon(s).")
+            st.success(f"Polygonize produced {n_line_polygons} polygon(s).")
 
         # Ensure there's at least one polygon now
-        if gdf_poly is None or len(gdf_poly) == 0:
+        if output is None:
             st.warning("No polygons available to save.")
             st.stop()
-
-        # write shapefile and zip
-        base = f"polygons_{int(time.time())}"
-        outdir = os.path.join(work_dir, "out")
-        zip_path = write_shapefile_and_zip(gdf_poly, outdir, base)
+        base, zip_bytes, preview_geojson, bounds = output
 
         # preview map and auto-zoom
         st.subheader("Preview")
-        m = make_folium_map(gdf_poly)
+        from streamlit_folium import st_folium
+
+        m = make_folium_map(preview_geojson, bounds)
         st_folium(m, width=700, height=450)
 
-        # prepare download (read bytes to memory)
-        with open(zip_path, "rb") as fh:
-            data = fh.read()
         st.success("Conversion done. Download the ZIP below.")
-        st.download_button("Download polygon shapefile (ZIP)", data, file_name=os.path.basename(zip_path))
+        st.download_button("Download polygon shapefile (ZIP)", zip_bytes, file_name=f"{base}.zip")
 
     except Exception as e:
         st.exception(e)
-    finally:
-        try:
-            shutil.rmtree(tmp_root)
-        except Exception:
-            pass
@@ -0,0 +1,44 @@
+import app
+
+UNNAMED_DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document>
+<Placemark><name>p</name><Polygon><outerBoundaryIs><LinearRing>
+<coordinates>0,0 1,0 1,1 0,1 0,0</coordinates>
+</LinearRing></outerBoundaryIs></Polygon></Placemark>
+</Document></kml>
+"""
+
+
+def test_load_polygons_unnamed_document():
+    # LIBKML names the layer of a document without <name> after the file it opened
+    gdf = app.load_polygons(UNNAMED_DOCUMENT)
+    assert list(gdf["Name"]) == ["p"]
+    assert list(gdf.geom_type) == ["Polygon"]
+
+FOLDERS_WITH_OWN_FIELDS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document><name>d</name>
+<Schema name="s" id="s"><SimpleField type="int" name="count"/><SimpleField type="double" name="size"/></Schema>
+<Folder><name>it's "A"</name>
+<Placemark><name>a</name><ExtendedData><Data name="owner"><value>x</value></Data></ExtendedData>
+<Polygon><outerBoundaryIs><LinearRing><coordinates>0,0 1,0 1,1 0,1 0,0</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>
+<Placemark><name>pt</name><Point><coordinates>0,0</coordinates></Point></Placemark>
+</Folder>
+<Folder><name>B</name>
+<Placemark><name>b</name><ExtendedData><Data name="zone"><value>z</value></Data></ExtendedData>
+<Polygon><outerBoundaryIs><LinearRing><coordinates>2,2 3,2 3,3 2,3 2,2</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>
+<Placemark><name>c</name><ExtendedData><SchemaData schemaUrl="#s">
+<SimpleData name="count">5</SimpleData><SimpleData name="size">2.5</SimpleData></SchemaData></ExtendedData>
+<Polygon><outerBoundaryIs><LinearRing><coordinates>4,4 5,4 5,5 4,5 4,4</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>
+</Folder>
+</Document></kml>
+"""
+
+def test_load_polygons_folders_with_own_fields():
+    # all folders come back from one query, with every folder's fields and no points;
+    # typed fields stay numeric even though the first folder has none of them
+    gdf = app.load_polygons(FOLDERS_WITH_OWN_FIELDS)
+    assert list(gdf["Name"]) == ["a", "b", "c"]
+    assert list(gdf["owner"].fillna("")) == ["x", "", ""]
+    assert list(gdf["zone"].fillna("")) == ["", "z", ""]
+    assert gdf["count"].dtype.kind in "if" and gdf["count"].iloc[2] == 5
+    assert gdf["size"].dtype.kind == "f" and gdf["size"].iloc[2] == 2.5